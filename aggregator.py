@@ -2,9 +2,23 @@ import os, json, datetime, logging, statistics
 from collections import defaultdict, Counter
 from google import genai
 
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
 class StrategicAggregatorPro:
     def __init__(self, api_key):
         self.client = genai.Client(api_key=api_key)
+        self.trend_snapshot = self.load_trend_snapshot()
+        
+    def load_trend_snapshot(self):
+        """Carga la última instantánea del TrendEngine (actualizada por el collector en cada run)"""
+        try:
+            with open(os.path.join(BASE_DIR, "BD_Noticias", "Config", "trend_detection.json"), 'r', encoding='utf-8') as f:
+                state_file = json.load(f)["state_file"]
+            with open(os.path.join(BASE_DIR, state_file), 'r', encoding='utf-8') as f:
+                return json.load(f).get("snapshot", {})
+        except Exception as e:
+            logging.warning(f"Sin estado de tendencias: {e}")
+            return {}
         
     def load_week_data(self, days_back=7):
         """Carga y analiza datos de la última semana completa"""
@@ -57,16 +71,20 @@ class StrategicAggregatorPro:
             if not metrics['proximities']:
                 continue
                 
-            # Tendencia de consenso
+            # Tendencia de consenso (semanal)
             if len(metrics['proximities']) >= 2:
                 trend = statistics.mean(metrics['proximities'][-3:]) - statistics.mean(metrics['proximities'][:3])
                 trend_dir = "↑" if trend > 5 else "↓" if trend < -5 else "→"
             else:
                 trend_dir = "→"
             
+            # Señal del último run frente a su historia EWMA (TrendEngine), si existe para el área
+            live_trend = self.trend_snapshot.get('areas', {}).get(area_name)
+            
             # Top regiones y keywords
             top_regions = [r[0] for r in metrics['regions'].most_common(3)]
             top_keywords = [k[0] for k in metrics['keywords'].most_common(5)]
+            emerging_terms = live_trend['emerging_terms'] if live_trend else []
             
             # Nivel de consenso semanal
             avg_prox = statistics.mean(metrics['proximities'])
@@ -88,8 +106,11 @@ class StrategicAggregatorPro:
                 'consensus_level': consensus_level,
                 'emoji': emoji,
                 'trend': trend_dir,
+                'latest_run_trend': live_trend['trend'] if live_trend else None,
+                'latest_run_delta': live_trend['proximity_delta'] if live_trend else None,
                 'top_regions': top_regions,
                 'top_keywords': top_keywords,
+                'emerging_terms': emerging_terms,
                 'signal_count': sum(metrics['regions'].values()),
                 'sample_titles': metrics['titles'][:5]  # Para contexto de IA
             }
@@ -106,8 +127,10 @@ class StrategicAggregatorPro:
 ### {area_name}
 **Nivel de Consenso:** {summary['emoji']} {summary['consensus_level']} ({summary['consensus_avg']}%)
 **Tendencia Semanal:** {summary['trend']}
+**Señal Último Run (vs. media EWMA):** {f"{summary['latest_run_trend']} ({summary['latest_run_delta']:+} pts)" if summary['latest_run_trend'] else 'sin datos'}
 **Bloques Más Activos:** {', '.join(summary['top_regions'])}
 **Temas Principales:** {', '.join(summary['top_keywords'])}
+**Términos Emergentes (ráfagas):** {', '.join(summary['emerging_terms']) or 'ninguno'}
 **Señales Analizadas:** {summary['signal_count']}
 
 **Muestras Representativas:**
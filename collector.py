@@ -9,10 +9,20 @@ import sys
 import logging
 import argparse
 import csv
+import calendar
+import queue
+import signal
+import statistics
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import feedparser
 from google import genai
 from google.genai import types
+from google.genai import errors
+from trend_engine import TrendEngine, extract_terms
 
 # --- LOGGING ---
 logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s | %(message)s')
@@ -21,6 +31,8 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s | %(levelname)-8s |
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 CONFIG_DIR = os.path.join(BASE_DIR, "BD_Noticias", "Config")
 DATA_DIR = os.path.join(BASE_DIR, "BD_Noticias", "Diario")
+CHECKPOINT_DIR = os.path.join(BASE_DIR, "BD_Noticias", "Checkpoints")
+SHARD_DIR = os.path.join(BASE_DIR, "BD_Noticias", "Shards")
 
 def load_config(filename):
     path = os.path.join(CONFIG_DIR, filename)
@@ -36,6 +48,9 @@ PIPELINE = load_config("pipeline_logic.json")
 CATEGORIES = load_config("categories.json")
 PHASE2_CONFIG = load_config("phase2_classification.json")
 PHASE3_CONFIG = load_config("phase3_proximity.json")
+TREND_CONFIG = load_config("trend_detection.json")
+
+EXIT_INCOMPLETE = 2  # Run exportado con trabajo fallido: el checkpoint queda abierto para --resume
 
 # --- NEWS ITEM ---
 class NewsItem:
@@ -49,6 +64,7 @@ class NewsItem:
         self.category = None  # Will be assigned in Phase 2
         self.embedding = None  # Will be calculated in Phase 3
         self.proximity_score = 0.0  # Distance from category centroid
+        self.keywords = []  # Extracted once in Phase 2 (trend detection)
         
     def _sanitize(self, text):
         if not text: return ""
@@ -63,83 +79,365 @@ class NewsItem:
             "region": self.region,
             "source": self.source_url,
             "category": self.category,
-            "proximity_score": self.proximity_score
+            "proximity_score": self.proximity_score,
+            "keywords": self.keywords
         }
 
+    def to_checkpoint(self):
+        data = self.to_dict()
+        data["embedding"] = self.embedding
+        return data
+
+    @classmethod
+    def from_checkpoint(cls, data):
+        item = cls(data["id"], data["title"], data["link"], data["region"], data["source"], data["description"])
+        item.category = data.get("category")
+        item.embedding = data.get("embedding")
+        item.proximity_score = data.get("proximity_score", 0.0)
+        item.keywords = data.get("keywords", [])
+        return item
+
+# --- EMBEDDING BACKENDS (Phase 3) ---
+class GeminiEmbeddingBackend:
+    """Embeddings remotos vía API de Gemini (modelo definido en phase3_proximity.json)"""
+    name = "gemini"
+    
+    def __init__(self, client):
+        self.client = client
+        self.model = PHASE3_CONFIG["embedding_model"]
+        self.batch_size = PHASE3_CONFIG["batch_processing"]["batch_size"]
+    
+    def embed(self, texts):
+        embeddings_response = self.client.models.embed_content(model=self.model, contents=texts)
+        return [e.values for e in embeddings_response.embeddings]
+
+class LocalEmbeddingBackend:
+    """Embeddings locales en CPU: n-gramas de caracteres hasheados + TF sublineal + proyección aleatoria.
+    Sin red ni cuota; pensado para desarrollo o cuando la API no está disponible.
+    El vector de un texto no depende del resto del lote (comparable entre llamadas, shards y runs)."""
+    name = "local"
+    batch_size = None  # Sin cuota ni latencia de red: un solo despacho con todo el corpus
+    
+    def __init__(self):
+        cfg = PHASE3_CONFIG["local_embedding"]
+        self.dimension = cfg["dimension"]
+        self.n_features = cfg["hash_features"]
+        self.ngram_min, self.ngram_max = cfg["ngram_range"]
+        self.block_size = cfg["block_size"]
+        
+        # Proyección gaussiana fija (misma semilla = vectores comparables entre runs)
+        rng = np.random.default_rng(cfg["seed"])
+        self.projection = rng.standard_normal((self.n_features, self.dimension), dtype=np.float32)
+        self.projection /= np.sqrt(self.dimension)
+    
+    def embed(self, texts):
+        n_docs = len(texts)
+        docs = [(" " + " ".join(t.lower().split()) + " ").encode("utf-8").replace(b"\x00", b"") for t in texts]
+        
+        # Corpus concatenado con separador 0: todos los n-gramas se hashean de una vez
+        data = np.frombuffer(b"\x00".join(docs), dtype=np.uint8)
+        lengths = np.array([len(d) + 1 for d in docs])
+        doc_of_byte = np.repeat(np.arange(n_docs), lengths)[:len(data)]
+        
+        rows, cols = [], []
+        for n in range(self.ngram_min, self.ngram_max + 1):
+            if len(data) < n:
+                continue
+            windows = sliding_window_view(data, n)
+            valid = (windows != 0).all(axis=1)  # Descartar n-gramas que cruzan documentos
+            h = np.full(len(windows), n, dtype=np.uint64)
+            for k in range(n):
+                h = (h * np.uint64(16777619) + windows[:, k]) & np.uint64(0xFFFFFFFF)
+            rows.append(doc_of_byte[:len(windows)][valid])
+            cols.append((h[valid] % np.uint64(self.n_features)).astype(np.int64))
+        
+        if not rows:
+            return [[0.0] * self.dimension for _ in texts]
+        
+        # TF sublineal fijo (sin IDF: el peso no depende de qué otros textos van en la llamada),
+        # normalizado L2 por documento
+        keys, tf = np.unique(np.concatenate(rows) * self.n_features + np.concatenate(cols), return_counts=True)
+        doc_idx, feat = keys // self.n_features, keys % self.n_features
+        weights = 1 + np.log(tf)
+        norms = np.sqrt(np.bincount(doc_idx, weights=weights ** 2, minlength=n_docs))
+        weights /= np.where(norms[doc_idx] > 0, norms[doc_idx], 1.0)
+        
+        # Proyección por bloques de documentos (keys ordenadas => doc_idx ordenado): la matriz
+        # TF densa del bloque solo incluye las columnas de n-gramas presentes en él
+        out = np.zeros((n_docs, self.dimension), dtype=np.float32)
+        for start in range(0, n_docs, self.block_size):
+            stop = min(start + self.block_size, n_docs)
+            lo, hi = np.searchsorted(doc_idx, [start, stop])
+            block_feats, columns = np.unique(feat[lo:hi], return_inverse=True)
+            dense = np.zeros((stop - start, len(block_feats)), dtype=np.float32)
+            dense[doc_idx[lo:hi] - start, columns] = weights[lo:hi]
+            out[start:stop] = dense @ self.projection[block_feats]
+        
+        out_norms = np.linalg.norm(out, axis=1, keepdims=True)
+        out /= np.where(out_norms > 0, out_norms, 1.0)
+        return out.tolist()
+
+def embedding_error_kind(e):
+    """Clasifica un error de embeddings: 'payload' (dividir el lote), 'quota' (esperar o abortar) u 'other'"""
+    if isinstance(e, errors.APIError):
+        if e.code == 429 or e.status == "RESOURCE_EXHAUSTED":
+            return "quota"
+        if e.code in (400, 413) or e.status == "INVALID_ARGUMENT":
+            return "payload"
+        return "other"
+    if isinstance(e, ValueError):
+        return "payload"
+    return "other"
+
+EMBEDDING_BACKENDS = {
+    GeminiEmbeddingBackend.name: lambda client: GeminiEmbeddingBackend(client),
+    LocalEmbeddingBackend.name: lambda client: LocalEmbeddingBackend()
+}
+
 # --- COLLECTOR V5 (GeoCore) ---
 class GeoCoreCollector:
-    def __init__(self, api_key):
+    def __init__(self, api_key, embedding_backend=None, regions=None):
         self.client = genai.Client(api_key=api_key)
+        self.embedder = EMBEDDING_BACKENDS[embedding_backend or PHASE3_CONFIG["embedding_backend"]](self.client)
+        self.regions = regions  # None = todas las regiones de feeds.json; lista = modo shard
+        self.run_id = datetime.datetime.now().strftime("%Y-%m-%d_%H%M")
+        if regions:
+            # Nombre del artefacto de shard; los shards no escriben en CHECKPOINT_DIR
+            self.run_id += "_" + "-".join(regions)
+        self.checkpointing = PIPELINE["checkpointing"]["enabled"] and not regions
+        self.merged_shards = []  # Artefactos unidos con --merge (se borran al completar el run)
+        self._synthesis_cache = {}  # category -> (ids de sus items, síntesis): evita regenerar sin cambios
+        self._synthesis_fallbacks = set()  # Categorías exportadas con texto de respaldo (síntesis fallida)
+        self.regional_pools = {}  # region -> [items] (raw pool, Phase 1)
         self.regional_data = {}  # region -> {narrative, items}
         self.thematic_groups = {}  # category -> [items] (populated in Phase 2)
+        self.alignment = {}  # category -> {pairs, region_matrix, gaps} (populated in Phase 3b)
+        self.trends = {}  # Snapshot del TrendEngine para este run (Phase 4b)
         self.stats = {"total_fetched": 0, "total_selected": 0, "regions_processed": 0}
         self.start_time = time.time()
+        self.phase_completed = 0  # Última fase persistida en checkpoint
+        self._embedding_failed = set()  # ids sin embedding tras reintentos (no se reenvían en este run)
+        self._embedding_aborted = threading.Event()  # Cuota agotada: no se envían más lotes
+        self._lock = threading.RLock()  # Estado compartido entre etapas del streaming
+        self._checkpoint_lock = threading.Lock()  # Serializa escrituras de checkpoint (fuera de self._lock)
         
         os.makedirs(DATA_DIR, exist_ok=True)
         os.makedirs("public", exist_ok=True)
 
+    def _active_feeds(self):
+        """Feeds de las regiones que procesa este run (todas, o las del shard)"""
+        if not self.regions:
+            return RSS_FEEDS
+        return {region: feeds for region, feeds in RSS_FEEDS.items() if region in self.regions}
+
     def fetch_and_synthesize_by_region(self):
         logging.info("🌍 FASE 1: Recolección y Síntesis Regional (V5 GeoCore)...")
         
         pool_size = PIPELINE["collection_params"]["pool_size_per_region"]
         min_items = PIPELINE["collection_params"]["min_items_for_synthesis"]
         
-        for region, feeds in RSS_FEEDS.items():
-            logging.info(f"  📍 Procesando: {region}")
-            
-            # 1. Recolectar pool regional completo
-            pool = []
-            for url in feeds:
-                try:
-                    d = feedparser.parse(url)
-                    for entry in d.entries[:pool_size]:
-                        title = entry.get('title', '')
-                        link = entry.get('link', '')
-                        desc = entry.get('summary', '') or entry.get('description', '')
-                        
-                        if not title: continue
-                        
-                        item_id = hashlib.md5(f"{title}|{link}".encode()).hexdigest()
-                        
-                        # Deduplicación regional simple
-                        if not any(x.title.lower() == title.lower() for x in pool):
-                            news = NewsItem(item_id, title, link, region, url, desc)
-                            pool.append(news)
-                            
-                except Exception as e:
-                    logging.warning(f"Feed error {url}: {e}")
+        for region, feeds in self._active_feeds().items():
+            if region in self.regional_data:
+                logging.info(f"  ⏭️ {region}: restaurado desde checkpoint")
+                continue
             
-            self.stats["total_fetched"] += len(pool)
-            logging.info(f"    ✓ Recolectados: {len(pool)} items")
+            logging.info(f"  📍 Procesando: {region}")
             
-            # 2. Síntesis via IA (si hay suficientes items)
-            if len(pool) < min_items:
-                logging.warning(f"    ⚠️ Insuficientes items para {region} ({len(pool)}). Saltando...")
-                continue
+            # 1. Recolectar pool regional completo (o reutilizar el del checkpoint)
+            pool = self.regional_pools.get(region)
+            if pool is not None:
+                logging.info(f"    ♻️ Pool restaurado: {len(pool)} items")
+            else:
+                pool = self._fetch_region_pool(region, feeds, pool_size)
+                self.stats["total_fetched"] += len(pool)
+                logging.info(f"    ✓ Recolectados: {len(pool)} items")
+                
+                # 2. Síntesis via IA (si hay suficientes items)
+                if len(pool) < min_items:
+                    logging.warning(f"    ⚠️ Insuficientes items para {region} ({len(pool)}). Saltando...")
+                    continue
+                self.regional_pools[region] = pool
             
             selected_items = self._synthesize_region(region, pool)
-            
+            self._apply_regional_selection(region, pool, selected_items)
+
+    def _fetch_region_pool(self, region, feeds, pool_size):
+        """Descarga los feeds de una región y deduplica por título"""
+        return self._merge_pool([self._fetch_feed(region, url, pool_size) for url in feeds])
+
+    def _fetch_feed(self, region, url, pool_size):
+        """Descarga un feed RSS y lo convierte en NewsItems"""
+        items = []
+        try:
+            d = feedparser.parse(url)
+            for entry in d.entries[:pool_size]:
+                title = entry.get('title', '')
+                link = entry.get('link', '')
+                desc = entry.get('summary', '') or entry.get('description', '')
+                
+                if not title: continue
+                
+                item_id = hashlib.md5(f"{title}|{link}".encode()).hexdigest()
+                items.append(NewsItem(item_id, title, link, region, url, desc))
+                
+        except Exception as e:
+            logging.warning(f"Feed error {url}: {e}")
+        return items
+
+    def _merge_pool(self, feed_items):
+        """Une los items de varios feeds en orden, con deduplicación regional simple por título"""
+        pool = []
+        seen_titles = set()
+        for items in feed_items:
+            for news in items:
+                key = news.title.lower()
+                if key not in seen_titles:
+                    seen_titles.add(key)
+                    pool.append(news)
+        return pool
+
+    def stream_regions(self, embed=True):
+        """FASES 1-2 (+ embeddings de la 3) en streaming con colas acotadas"""
+        logging.info("🌊 FASES 1-3: Pipeline en streaming (fetch → síntesis → clasificación → embeddings)...")
+        
+        cfg = PIPELINE["streaming"]
+        pool_size = PIPELINE["collection_params"]["pool_size_per_region"]
+        min_items = PIPELINE["collection_params"]["min_items_for_synthesis"]
+        embed_batch = PHASE3_CONFIG["batch_processing"]["batch_size"]
+        
+        synth_queue = queue.Queue(maxsize=cfg["queue_size"])  # (region, pool)
+        embed_queue = queue.Queue(maxsize=cfg["queue_size"])  # [items]
+        self.thematic_groups = defaultdict(list)
+        
+        def classify_and_queue(items):
+            for item in items:
+                self._classify_item(item)
+            with self._lock:
+                for item in items:
+                    self.thematic_groups[item.category].append(item)
+            pending = [item for item in items if not item.embedding]
+            # Backends sin lotes (local) embeben todo el corpus al final, en calculate_proximity
+            if pending and embed and self.embedder.batch_size:
+                embed_queue.put(pending)
+        
+        def synthesis_worker():
+            while True:
+                job = synth_queue.get()
+                if job is None:
+                    return
+                region, pool = job
+                try:
+                    selected_items = self._synthesize_region(region, pool)
+                    classify_and_queue(self._apply_regional_selection(region, pool, selected_items))
+                except Exception as e:
+                    logging.error(f"Error en etapa de síntesis para {region}: {e}")
+        
+        def flush(items):
+            try:
+                self._embed_items(items)
+            except Exception as e:
+                # Los items sin embedding se reintentan en calculate_proximity
+                logging.error(f"Error en etapa de embeddings: {e}")
+        
+        def embedding_worker():
+            # Acumula items de todas las regiones y solo envía lotes llenos;
+            # el resto se despacha junto con los reintentos en calculate_proximity
+            batch = []
+            while True:
+                items = embed_queue.get()
+                if items is None:
+                    return
+                batch.extend(items)
+                while len(batch) >= embed_batch:
+                    flush(batch[:embed_batch])
+                    batch = batch[embed_batch:]
+        
+        workers = [threading.Thread(target=synthesis_worker, daemon=True) for _ in range(cfg["synthesis_workers"])]
+        workers.append(threading.Thread(target=embedding_worker, daemon=True))
+        for worker in workers:
+            worker.start()
+        
+        # Regiones restauradas desde checkpoint: directo a clasificación / síntesis
+        pending_feeds = {}
+        for region, feeds in self._active_feeds().items():
+            if region in self.regional_data:
+                logging.info(f"  ⏭️ {region}: restaurado desde checkpoint")
+                classify_and_queue(self.regional_data[region]["items"])
+            elif region in self.regional_pools:
+                logging.info(f"  ♻️ {region}: pool restaurado ({len(self.regional_pools[region])} items)")
+                synth_queue.put((region, self.regional_pools[region]))
+            elif feeds:
+                pending_feeds[region] = [None] * len(feeds)
+        
+        # Productor: cada región pasa a síntesis en cuanto terminan todos sus feeds
+        with ThreadPoolExecutor(max_workers=cfg["fetch_workers"]) as executor:
+            futures = {
+                executor.submit(self._fetch_feed, region, url, pool_size): (region, i)
+                for region in pending_feeds
+                for i, url in enumerate(RSS_FEEDS[region])
+            }
+            for future in as_completed(futures):
+                region, i = futures[future]
+                pending_feeds[region][i] = future.result()
+                if any(items is None for items in pending_feeds[region]):
+                    continue
+                
+                pool = self._merge_pool(pending_feeds.pop(region))
+                with self._lock:
+                    self.stats["total_fetched"] += len(pool)
+                logging.info(f"  📍 {region}: {len(pool)} items recolectados")
+                
+                if len(pool) < min_items:
+                    logging.warning(f"    ⚠️ Insuficientes items para {region} ({len(pool)}). Saltando...")
+                    continue
+                with self._lock:
+                    self.regional_pools[region] = pool
+                synth_queue.put((region, pool))
+        
+        # Drenar etapas en orden: síntesis → embeddings
+        for _ in range(cfg["synthesis_workers"]):
+            synth_queue.put(None)
+        for worker in workers[:-1]:
+            worker.join()
+        embed_queue.put(None)
+        workers[-1].join()
+        
+        # Orden determinista (el de feeds.json), independiente de qué región terminó primero
+        self.regional_pools = {r: self.regional_pools[r] for r in RSS_FEEDS if r in self.regional_pools}
+        self.regional_data = {r: self.regional_data[r] for r in RSS_FEEDS if r in self.regional_data}
+        self.thematic_groups = defaultdict(list)
+        for data in self.regional_data.values():
+            for item in data["items"]:
+                self.thematic_groups[item.category].append(item)
+        
+        for cat, items in self.thematic_groups.items():
+            logging.info(f"  ✓ {cat}: {len(items)} noticias")
+        self.stats["categories_found"] = len(self.thematic_groups)
+
+    def _apply_regional_selection(self, region, pool, selected_items):
+        """Mapea la selección de la IA al pool y persiste el avance de la Fase 1"""
+        with self._lock:
             if selected_items:
                 # ESTRATEGIA: Índices Numéricos (1-based) -> Items
                 # La IA devuelve [1, 5, 10...], nosotros mapeamos a pool[0], pool[4], pool[9]...
                 selected_indices = selected_items.get("selected_indexes", [])
-                
+            
                 filtered_items = []
                 for idx in selected_indices:
                     # Validar rango (1 a len(pool))
                     if isinstance(idx, int) and 1 <= idx <= len(pool):
                         filtered_items.append(pool[idx-1]) # Convertir a 0-based
-                
+            
                 # Enforce limits: truncate if too many, warn if too few
                 min_sel = PIPELINE["collection_params"]["output_stories_min"]
                 max_sel = PIPELINE["collection_params"]["output_stories_max"]
-                
+            
                 if len(filtered_items) > max_sel:
                     logging.warning(f"    ⚠️ Truncando de {len(filtered_items)} a {max_sel} items")
                     filtered_items = filtered_items[:max_sel]
                 elif len(filtered_items) < min_sel:
                     logging.warning(f"    ⚠️ Solo {len(filtered_items)} items válidos (esperado {min_sel})")
-                
+            
                 self.regional_data[region] = {
                     "narrative": selected_items["narrative"],
                     "confidence": selected_items.get("confidence", "medium"),
@@ -148,6 +446,33 @@ class GeoCoreCollector:
                 self.stats["total_selected"] += len(filtered_items)
                 self.stats["regions_processed"] += 1
                 logging.info(f"    ✅ Seleccionados: {len(filtered_items)} / Narrativa: {selected_items['narrative'][:60]}...")
+            selected = self.regional_data[region]["items"] if region in self.regional_data else []
+        
+        # Checkpoint incremental: una región sintetizada no vuelve a gastar llamadas
+        self._save_checkpoint(phase=0)
+        return selected
+
+    def _unsynthesized_regions(self):
+        """Regiones con pool suficiente cuya síntesis falló (p.ej. cuota agotada)"""
+        return sorted(region for region in self.regional_pools if region not in self.regional_data)
+
+    def incomplete_work(self):
+        """Trabajo fallido del run: [(fase que queda abierta, descripción)]"""
+        open_work = []
+        missing = self._unsynthesized_regions()
+        if missing:
+            open_work.append((1, f"sin síntesis regional para {', '.join(missing)}"))
+        if self._embedding_aborted.is_set() or self.stats.get("embedding_missing"):
+            without_embedding = sum(self.stats.get("embedding_missing", {}).values())
+            reason = " (cuota agotada)" if self._embedding_aborted.is_set() else ""
+            open_work.append((3, f"{without_embedding} items sin embedding{reason}"))
+        if self._synthesis_fallbacks:
+            open_work.append((5, f"síntesis de respaldo para {', '.join(sorted(self._synthesis_fallbacks))}"))
+        return open_work
+
+    def _completed_phase(self, phase):
+        """Fase a registrar en el checkpoint: una fase con trabajo fallido queda abierta"""
+        return min([phase] + [open_phase - 1 for open_phase, _ in self.incomplete_work() if open_phase <= phase])
 
     def _synthesize_region(self, region, pool):
         """Envía el pool completo a la IA para síntesis y selección"""
@@ -195,28 +520,8 @@ class GeoCoreCollector:
         logging.info(f"  📊 Total de noticias a clasificar: {len(all_items)}")
         
         # Clasificar cada noticia por categoría usando keywords (config from phase2_classification.json)
-        categories_data = CATEGORIES["categories"]
-        fallback_cat = PHASE2_CONFIG["fallback_category"]
-        case_sensitive = PHASE2_CONFIG["classification_rules"]["case_sensitive"]
-        
         for item in all_items:
-            # Build search text from configured fields
-            search_fields = PHASE2_CONFIG["classification_rules"]["search_fields"]
-            text_parts = [getattr(item, field, "") for field in search_fields]
-            text = " ".join(text_parts)
-            if not case_sensitive:
-                text = text.lower()
-            
-            item.category = fallback_cat  # Default from config
-            
-            # Buscar coincidencias con keywords
-            for cat_name, cat_info in categories_data.items():
-                if cat_name == fallback_cat:
-                    continue
-                keywords = cat_info["keywords"]
-                if any(keyword in text for keyword in keywords):
-                    item.category = cat_name
-                    break
+            self._classify_item(item)
         
         # Agrupar por categoría
         self.thematic_groups = defaultdict(list)
@@ -228,6 +533,39 @@ class GeoCoreCollector:
         
         self.stats["categories_found"] = len(self.thematic_groups)
 
+    def _classify_item(self, item):
+        """Asigna la categoría de un item por keywords (primera coincidencia gana)"""
+        categories_data = CATEGORIES["categories"]
+        fallback_cat = PHASE2_CONFIG["fallback_category"]
+        case_sensitive = PHASE2_CONFIG["classification_rules"]["case_sensitive"]
+        
+        # Build search text from configured fields
+        search_fields = PHASE2_CONFIG["classification_rules"]["search_fields"]
+        text_parts = [getattr(item, field, "") for field in search_fields]
+        text = " ".join(text_parts)
+        if not case_sensitive:
+            text = text.lower()
+        
+        item.category = fallback_cat  # Default from config
+        
+        # Buscar coincidencias con keywords
+        for cat_name, cat_info in categories_data.items():
+            if cat_name == fallback_cat:
+                continue
+            keywords = cat_info["keywords"]
+            if any(keyword in text for keyword in keywords):
+                item.category = cat_name
+                break
+        
+        # Términos para detección de tendencias (una sola vez por item)
+        terms_cfg = TREND_CONFIG["term_extraction"]
+        item.keywords = extract_terms(
+            " ".join(getattr(item, field, "") for field in terms_cfg["fields"]),
+            set(terms_cfg["stopwords"]),
+            terms_cfg["min_length"],
+            terms_cfg["max_terms_per_item"]
+        )
+
     def calculate_proximity(self):
         """FASE 3: Calcular proximidad narrativa usando centroide temático"""
         logging.info("📐 FASE 3: Cálculo de Proximidad Narrativa (Centroide)...")
@@ -235,51 +573,33 @@ class GeoCoreCollector:
         import math
         
         # Load config parameters
-        embedding_model = PHASE3_CONFIG["embedding_model"]
-        embedding_fields = PHASE3_CONFIG["embedding_fields"]
-        separator = PHASE3_CONFIG["embedding_separator"]
         min_items = PHASE3_CONFIG["centroid_calculation"]["min_items_for_centroid"]
         
+        # 1. Embeddings de todas las categorías en un solo despacho global (lotes llenos);
+        # los items que ya fallaron en la etapa de streaming no se reenvían
+        pending = [item for items in self.thematic_groups.values() for item in items
+                   if not item.embedding and item.id not in self._embedding_failed]
+        if pending:
+            self._embed_items(pending)
+        
+        missing = {}
         for category, items in self.thematic_groups.items():
+            # Sin vector no hay proximidad: None (no 0.0, que se leería como divergencia máxima)
+            for item in items:
+                if not item.embedding:
+                    item.proximity_score = None
+            without_embedding = sum(1 for item in items if not item.embedding)
+            if without_embedding:
+                missing[category] = without_embedding
+                logging.warning(f"  ⚠️ {category}: {without_embedding}/{len(items)} items sin embedding (excluidos del centroide)")
+            
             if len(items) < min_items:
                 logging.info(f"  ⚠️ {category}: Insuficientes items para centroide ({len(items)} < {min_items})")
                 continue
             
             logging.info(f"  🎯 Procesando: {category} ({len(items)} items)")
             
-            # 1. Generar embeddings para todos los items de esta categoría
-            # Build text from configured fields
-            texts = []
-            for item in items:
-                field_values = [getattr(item, field, "") for field in embedding_fields]
-                text = separator.join(field_values)
-                texts.append(text)
-            
             try:
-                # Procesar en lotes de 100 (límite de la API de Gemini)
-                BATCH_SIZE = 100
-                all_embeddings = []
-                
-                for i in range(0, len(texts), BATCH_SIZE):
-                    batch_texts = texts[i:i + BATCH_SIZE]
-                    try:
-                        embeddings_response = self.client.models.embed_content(
-                            model=embedding_model,
-                            contents=batch_texts
-                        )
-                        # Extraer valores y añadir a la lista general
-                        batch_values = [e.values for e in embeddings_response.embeddings]
-                        all_embeddings.extend(batch_values)
-                    except Exception as e:
-                         logging.error(f"Error en batch {i}: {e}")
-                         # Rellenar con None para mantener índices alineados si falla un batch
-                         all_embeddings.extend([None] * len(batch_texts))
-
-                # Asignar embeddings a cada item
-                for i, embedding_values in enumerate(all_embeddings):
-                    if embedding_values:
-                         items[i].embedding = embedding_values
-                
                 # 2. Calcular centroide (vector promedio) - method from config
                 valid_embeddings = [item.embedding for item in items if item.embedding]
                 if not valid_embeddings:
@@ -302,16 +622,214 @@ class GeoCoreCollector:
                         # Formula: ((cosine_similarity + 1) / 2) * 100
                         item.proximity_score = ((similarity + 1) / 2) * 100
                 
-                logging.info(f"    ✅ Proximidad calculada para {len(valid_embeddings)} items")
+                logging.info(f"    ✅ Proximidad calculada para {len(valid_embeddings)}/{len(items)} items")
                 
             except Exception as e:
                 logging.error(f"Error calculando proximidad para {category}: {e}")
+        
+        self.stats["embedding_missing"] = missing
+
+    def _embed_items(self, items):
+        """Despacha embeddings en lotes llenos y concurrentes. Solo los errores de payload
+        dividen el lote en mitades (hasta items individuales); cuota y errores transitorios
+        se reintentan con backoff, y si la cuota sigue agotada se abortan los lotes restantes.
+        Devuelve los items que quedaron sin embedding."""
+        embedding_fields = PHASE3_CONFIG["embedding_fields"]
+        separator = PHASE3_CONFIG["embedding_separator"]
+        batch_cfg = PHASE3_CONFIG["batch_processing"]
+        batch_size = self.embedder.batch_size or max(len(items), 1)
+        max_concurrent = batch_cfg["max_concurrent_batches"]
+        
+        # Build text from configured fields
+        texts = []
+        for item in items:
+            field_values = [getattr(item, field, "") for field in embedding_fields]
+            text = separator.join(field_values)
+            texts.append(text)
+        
+        def send(indices):
+            for attempt in range(batch_cfg["max_retries"] + 1):
+                if self._embedding_aborted.is_set():
+                    return indices
+                with self._lock:
+                    self.stats["embedding_requests"] = self.stats.get("embedding_requests", 0) + 1
+                try:
+                    batch_values = self.embedder.embed([texts[i] for i in indices])
+                    if len(batch_values) != len(indices):
+                        raise ValueError(f"{len(batch_values)} embeddings para {len(indices)} textos")
+                    break
+                except Exception as e:
+                    kind = embedding_error_kind(e)
+                    if kind == "payload":
+                        if len(indices) == 1:
+                            logging.error(f"    ❌ Embedding fallido para {items[indices[0]].id}: {e}")
+                            return indices
+                        logging.debug(f"    Lote de {len(indices)} rechazado ({e}). Reintentando en mitades...")
+                        mid = len(indices) // 2
+                        return send(indices[:mid]) + send(indices[mid:])
+                    if attempt == batch_cfg["max_retries"]:
+                        if kind == "quota" and not self._embedding_aborted.is_set():
+                            logging.error(f"    ❌ Cuota de embeddings agotada ({e}). Se abortan los lotes restantes")
+                            self._embedding_aborted.set()
+                        elif kind != "quota":
+                            logging.error(f"    ❌ Lote de {len(indices)} fallido tras {attempt + 1} intentos: {e}")
+                        return indices
+                    time.sleep(batch_cfg["retry_backoff_seconds"] * 2 ** attempt)
+            
+            # Redistribuir cada vector a su item (y por tanto a su categoría)
+            for i, embedding_values in zip(indices, batch_values):
+                items[i].embedding = embedding_values
+            return []
+        
+        batches = [list(range(i, min(i + batch_size, len(items)))) for i in range(0, len(items), batch_size)]
+        failed = []
+        with ThreadPoolExecutor(max_workers=max_concurrent) as executor:
+            for batch_failed in executor.map(send, batches):
+                failed.extend(batch_failed)
+        
+        if failed:
+            with self._lock:
+                self._embedding_failed.update(items[i].id for i in failed)
+            logging.warning(f"  ⚠️ {len(failed)}/{len(items)} items sin embedding tras reintentos")
+        return [items[i] for i in failed]
+
+    def align_cross_region(self):
+        """FASE 3b: Emparejar eventos entre regiones (matriz región × región por categoría)"""
+        logging.info("🔗 FASE 3b: Alineación de Eventos Cross-Regionales...")
+
+        align_cfg = PHASE3_CONFIG["cross_region_alignment"]
+        if not align_cfg.get("enabled", True):
+            logging.info("  ⏭️ Alineación desactivada en config")
+            return
+
+        block_size = align_cfg["block_size"]
+        threshold = align_cfg["match_threshold"][self.embedder.name]
+        max_pairs = align_cfg["max_pairs_per_category"]
+        max_gaps = align_cfg["max_gaps_per_region"]
+        total_pairs = 0
+
+        for category, items in self.thematic_groups.items():
+            # Agrupar por región solo los items con embedding (matrices normalizadas)
+            by_region = defaultdict(list)
+            for item in items:
+                if item.embedding:
+                    by_region[item.region].append(item)
+
+            regions = sorted(by_region)
+            if len(regions) < 2:
+                continue
+
+            matrices = {}
+            for region in regions:
+                m = np.asarray([item.embedding for item in by_region[region]], dtype=np.float32)
+                norms = np.linalg.norm(m, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                matrices[region] = m / norms
+
+            # best[a][b] = (sim, idx): mejor coincidencia en b para cada item de a
+            best = defaultdict(dict)
+            for i, region_a in enumerate(regions):
+                for region_b in regions[i + 1:]:
+                    ab, ba = self._blockwise_best_match(matrices[region_a], matrices[region_b], block_size)
+                    best[region_a][region_b] = ab
+                    best[region_b][region_a] = ba
+
+            # 1. Pares de eventos: mejores coincidencias mutuas sobre el umbral
+            pairs = []
+            region_matrix = {region: {} for region in regions}
+            for i, region_a in enumerate(regions):
+                for region_b in regions[i + 1:]:
+                    sim_ab, idx_ab = best[region_a][region_b]
+                    _, idx_ba = best[region_b][region_a]
+                    matched = 0
+                    for ia, ib in enumerate(idx_ab):
+                        if sim_ab[ia] >= threshold and idx_ba[ib] == ia:
+                            matched += 1
+                            item_a, item_b = by_region[region_a][ia], by_region[region_b][ib]
+                            pairs.append({
+                                "regions": [region_a, region_b],
+                                "ids": [item_a.id, item_b.id],
+                                "titles": [item_a.title, item_b.title],
+                                "similarity": round(float(sim_ab[ia]), 3)
+                            })
+                    region_matrix[region_a][region_b] = matched
+                    region_matrix[region_b][region_a] = matched
+
+            pairs.sort(key=lambda p: p["similarity"], reverse=True)
+
+            # 2. Huecos de cobertura: eventos cubiertos por ≥2 regiones que una región ignora
+            gaps = {}
+            for region in regions:
+                missing = []
+                for other in regions:
+                    if other == region:
+                        continue
+                    sim_to_region, _ = best[other][region]
+                    for idx, item in enumerate(by_region[other]):
+                        if sim_to_region[idx] >= threshold:
+                            continue
+                        covered_by = [r for r in regions if r not in (region, other)
+                                      and best[other][r][0][idx] >= threshold]
+                        if covered_by:
+                            missing.append((len(covered_by), other, idx, [other] + covered_by))
+                missing.sort(key=lambda m: m[0], reverse=True)
+
+                # El mismo evento aparece una vez por región que lo cubre: reportarlo solo una vez
+                reported = []
+                for _, other, idx, covered in missing:
+                    if len(reported) >= max_gaps:
+                        break
+                    if any(r_other != other and r_other in covered and best[other][r_other][1][idx] == r_idx
+                           for r_other, r_idx, _ in reported):
+                        continue
+                    reported.append((other, idx, covered))
+                if reported:
+                    gaps[region] = [
+                        {"id": by_region[other][idx].id, "title": by_region[other][idx].title,
+                         "covered_by": sorted(covered)}
+                        for other, idx, covered in reported
+                    ]
+
+            self.alignment[category] = {
+                "pairs": pairs[:max_pairs],
+                "region_matrix": region_matrix,
+                "gaps": gaps
+            }
+            total_pairs += len(pairs)
+            logging.info(f"  ✓ {category}: {len(pairs)} eventos compartidos, {len(gaps)} regiones con huecos")
+
+        self.stats["cross_region_pairs"] = total_pairs
+
+    def _blockwise_best_match(self, a, b, block_size):
+        """Mejor coincidencia coseno a→b y b→a calculada por bloques (memoria O(block_size²))"""
+        best_ab = np.full(len(a), -1.0, dtype=np.float32)
+        idx_ab = np.zeros(len(a), dtype=np.int64)
+        best_ba = np.full(len(b), -1.0, dtype=np.float32)
+        idx_ba = np.zeros(len(b), dtype=np.int64)
+
+        for i in range(0, len(a), block_size):
+            block_a = a[i:i + block_size]
+            for j in range(0, len(b), block_size):
+                sims = block_a @ b[j:j + block_size].T
+
+                row_idx = sims.argmax(axis=1)
+                row_max = sims[np.arange(len(row_idx)), row_idx]
+                better = row_max > best_ab[i:i + block_size]
+                best_ab[i:i + block_size][better] = row_max[better]
+                idx_ab[i:i + block_size][better] = row_idx[better] + j
+
+                col_idx = sims.argmax(axis=0)
+                col_max = sims[col_idx, np.arange(len(col_idx))]
+                better = col_max > best_ba[j:j + block_size]
+                best_ba[j:j + block_size][better] = col_max[better]
+                idx_ba[j:j + block_size][better] = col_idx[better] + i
+
+        return (best_ab, idx_ab), (best_ba, idx_ba)
 
     def save_audit_csv(self):
         """Guarda CSV con todas las noticias seleccionadas (auditoría)"""
         logging.info("💾 FASE 4: Guardando Auditoría CSV...")
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H%M")
-        filename = os.path.join(DATA_DIR, f"run_{timestamp}.csv")
+        filename = os.path.join(DATA_DIR, f"run_{self.run_id}.csv")
         
         try:
             with open(filename, 'w', newline='', encoding='utf-8-sig') as f:
@@ -328,13 +846,35 @@ class GeoCoreCollector:
                             item.description,
                             item.source_url,
                             item.link,
-                            round(item.proximity_score, 2)
+                            round(item.proximity_score, 2) if item.proximity_score is not None else ""
                         ])
             
             logging.info(f"✅ CSV guardado: {filename}")
         except Exception as e:
             logging.error(f"Error guardando CSV: {e}")
 
+    def update_trends(self):
+        """FASE 4b: Actualiza las estadísticas de tendencia con los items de este run"""
+        logging.info("📈 FASE 4b: Detección de Tendencias y Ráfagas...")
+        
+        try:
+            engine = TrendEngine(TREND_CONFIG, os.path.join(BASE_DIR, TREND_CONFIG["state_file"])).load()
+            for category, items in self.thematic_groups.items():
+                for item in items:
+                    # Sin embedding no hay proximidad real: no debe arrastrar la media EWMA del área
+                    if item.embedding is None:
+                        continue
+                    engine.observe(category, item.keywords, item.proximity_score)
+            self.trends = engine.close_run(self.run_id)
+            engine.save()
+            
+            for burst in self.trends["bursts"]:
+                logging.info(f"  🔥 {burst['term']} ({burst['area']}): {burst['count']} menciones, z={burst['z']}")
+            if not self.trends["warm"]:
+                logging.info("  ⏳ Historia insuficiente: ráfagas desactivadas durante el calentamiento")
+        except Exception as e:
+            logging.error(f"Error actualizando tendencias: {e}")
+
     def export(self):
         """Exporta JSON para el frontend (organizado por CATEGORÍA TEMÁTICA con colores Cyberpunk)"""
         logging.info("📦 FASE 5: Exportación JSON...")
@@ -369,13 +909,15 @@ class GeoCoreCollector:
                     "region": item.region,
                     "url": item.link,
                     "description": item.description,
-                    "proximity_score": round(item.proximity_score, 2)
+                    "proximity_score": round(item.proximity_score, 2) if item.proximity_score is not None else None,
+                    "keywords": item.keywords
                 }
                 for item in items
             ]
             
-            # Calcular promedio de proximidad
-            avg_proximity = sum(p["proximity_score"] for p in particles) / len(particles) if particles else 0
+            # Calcular promedio de proximidad (solo items con embedding)
+            scores = [p["proximity_score"] for p in particles if p["proximity_score"] is not None]
+            avg_proximity = sum(scores) / len(scores) if scores else None
             
             # Generar síntesis temática usando IA (captura divergencias narrativas)
             regional_narratives = defaultdict(str)
@@ -387,7 +929,8 @@ class GeoCoreCollector:
                         break
             
             # Crear síntesis con IA que capture divergencias
-            synthesis = self._generate_category_synthesis(category, regional_narratives, items)
+            alignment = self.alignment.get(category, {"pairs": [], "region_matrix": {}, "gaps": {}})
+            synthesis = self._generate_category_synthesis(category, regional_narratives, items, alignment)
             
             # Sanitizar nombres de regiones para consistencia (ej. USA vs NORTEAMERICA)
             # Mapeo simple para asegurar keys consistentes en frontend
@@ -401,9 +944,11 @@ class GeoCoreCollector:
                 "sintesis": synthesis,
                 "sintesis_en": synthesis,
                 "regional_syntheses": export_regional_narratives, # NEW: Per-region narratives
+                "alignment": alignment, # Eventos compartidos y huecos por región
+                "trend": self.trends.get("areas", {}).get(category), # Tendencia vs historia (Fase 4b)
                 "color": color,   # COLOR CYBERPUNK
                 "count": len(particles),
-                "avg_proximity": round(avg_proximity, 2),
+                "avg_proximity": round(avg_proximity, 2) if avg_proximity is not None else None,
                 "particulas": particles
             })
         
@@ -413,6 +958,7 @@ class GeoCoreCollector:
                 "generated": datetime.datetime.now().isoformat(),
                 "pipeline_version": PIPELINE["version"],
                 "stats": self.stats,
+                "trends": {"bursts": self.trends.get("bursts", []), "warm": self.trends.get("warm", False)},
                 "execution_time": round(time.time() - self.start_time, 2)
             }
         }
@@ -422,9 +968,16 @@ class GeoCoreCollector:
         
         logging.info(f"✅ Exportado: {len(carousel)} categorías, {self.stats['total_selected']} noticias")
 
-    def _generate_category_synthesis(self, category, regional_narratives, items):
+    def _generate_category_synthesis(self, category, regional_narratives, items, alignment=None):
         """Genera síntesis temática usando titulares específicos para evitar repetición"""
         
+        # Misma categoría con los mismos items (daemon sin cambios en ella): reutilizar la síntesis
+        item_ids = frozenset(item.id for item in items)
+        cached = self._synthesis_cache.get(category)
+        if cached and cached[0] == item_ids:
+            self._synthesis_fallbacks.discard(category)
+            return cached[1]
+        
         # Agrupar titulares por región
         headlines_by_region = defaultdict(list)
         for item in items:
@@ -438,14 +991,27 @@ class GeoCoreCollector:
         for region, headlines in headlines_by_region.items():
             # Usar hasta 8 titulares por región para dar contexto rico
             source_text += f"\nREGION: {region}\n" + "\n".join(headlines[:8])
+
+        # Eventos compartidos entre regiones (Fase 3b) para contrastar el mismo hecho
+        alignment_text = ""
+        if alignment and alignment["pairs"]:
+            alignment_text += "\nSAME EVENT ACROSS REGIONS:\n" + "\n".join(
+                f"- [{p['regions'][0]}] {p['titles'][0]} <-> [{p['regions'][1]}] {p['titles'][1]}"
+                for p in alignment["pairs"])
+        if alignment and alignment["gaps"]:
+            alignment_text += "\nCOVERAGE GAPS (event covered elsewhere, absent in region):\n" + "\n".join(
+                f"- {region} ignores: {g['title']} (covered by {', '.join(g['covered_by'])})"
+                for region, gaps in alignment["gaps"].items() for g in gaps)
         
         prompt = f"""CATEGORY: {category}
         
         SOURCE MATERIAL (Specific Headlines per Region):
         {source_text}
+        {alignment_text}
         
         TASK: Synthesize the global narrative divergence on this specific topic based ONLY on the headlines above.
         - Analyze specific events mentioned in these headlines.
+        - Where the same event is covered by several regions, contrast how each one frames it; note notable silences.
         - Contrast regional perspectives (e.g. "While West focuses on [Specific Event X], Russia emphasizes [Perspective Y]").
         - Be specific to the headlines provided. Do NOT use generic geopolitical boilerplate.
         
@@ -456,28 +1022,494 @@ class GeoCoreCollector:
                 model="gemini-2.0-flash",
                 contents=prompt
             )
-            return response.text.strip()
+            synthesis = response.text.strip()
+            self._synthesis_cache[category] = (item_ids, synthesis)
+            self._synthesis_fallbacks.discard(category)
+            return synthesis
         except Exception as e:
             logging.warning(f"Error generando síntesis para {category}: {e}")
+            self._synthesis_fallbacks.add(category)
             return f"{category}: {len(items)} noticias. Divergencia detectada entre {', '.join(headlines_by_region.keys())}."
 
-    def run(self):
+    def _state_dict(self, phase):
+        """Serializa el estado del run (checkpoints y artefactos de shard comparten formato)"""
+        # Los items se guardan una sola vez dentro de su pool; el resto son referencias (región, índice)
+        refs = {}
+        pools = {}
+        for region, pool in self.regional_pools.items():
+            pools[region] = [item.to_checkpoint() for item in pool]
+            for idx, item in enumerate(pool):
+                refs[id(item)] = [region, idx]
+        
+        return {
+            "run_id": self.run_id,
+            "pipeline_version": PIPELINE["version"],
+            "phase_completed": phase,
+            "saved_at": datetime.datetime.now().isoformat(),
+            "stats": self.stats,
+            "regional_pools": pools,
+            "regional_data": {
+                region: {
+                    "narrative": data["narrative"],
+                    "confidence": data["confidence"],
+                    "items": [refs[id(item)] for item in data["items"]]
+                }
+                for region, data in self.regional_data.items()
+            },
+            "thematic_groups": {
+                category: [refs[id(item)] for item in items]
+                for category, items in self.thematic_groups.items()
+            },
+            "alignment": self.alignment,
+            "trends": self.trends,
+            "category_syntheses": {
+                category: {"ids": sorted(ids), "text": text}
+                for category, (ids, text) in self._synthesis_cache.items()
+            },
+            "embedding_backend": self.embedder.name
+        }
+
+    def _write_state(self, path, state):
+        # Escritura atómica: un run interrumpido nunca deja un archivo a medias
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(path + ".tmp", path)
+
+    def _read_state(self, path):
+        """Carga y reconstruye un estado serializado. Lanza excepción si es inválido"""
+        with open(path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state["pipeline_version"] != PIPELINE["version"]:
+            raise ValueError(f"versión {state['pipeline_version']} != {PIPELINE['version']}")
+        
+        pools = {
+            region: [NewsItem.from_checkpoint(data) for data in items]
+            for region, items in state["regional_pools"].items()
+        }
+        regional_data = {
+            region: {
+                "narrative": data["narrative"],
+                "confidence": data["confidence"],
+                "items": [pools[r][idx] for r, idx in data["items"]]
+            }
+            for region, data in state["regional_data"].items()
+        }
+        thematic_groups = defaultdict(list)
+        for category, refs in state["thematic_groups"].items():
+            thematic_groups[category] = [pools[r][idx] for r, idx in refs]
+        
+        # Vectores de otro backend no son comparables
+        if state.get("embedding_backend") != self.embedder.name:
+            for pool in pools.values():
+                for item in pool:
+                    item.embedding = None
+            if state["phase_completed"] > 2:
+                state["phase_completed"] = 2
+            logging.info(f"  ♻️ Embeddings descartados (backend {state.get('embedding_backend')} → {self.embedder.name})")
+        
+        return state, pools, regional_data, thematic_groups
+
+    def _save_checkpoint(self, phase):
+        """Persiste el estado del run tras una fase (0 = Fase 1 en curso)"""
+        if not self.checkpointing:
+            return
+        self.phase_completed = phase
+        
+        os.makedirs(CHECKPOINT_DIR, exist_ok=True)
+        with self._checkpoint_lock:
+            try:
+                # Instantánea bajo el lock del streaming; la escritura a disco no bloquea a los workers
+                with self._lock:
+                    state = self._state_dict(phase)
+                self._write_state(os.path.join(CHECKPOINT_DIR, f"{self.run_id}.json"), state)
+            except Exception as e:
+                logging.warning(f"Error guardando checkpoint: {e}")
+                return
+        
+        keep_last = PIPELINE["checkpointing"]["keep_last"]
+        paths = [os.path.join(CHECKPOINT_DIR, f) for f in os.listdir(CHECKPOINT_DIR) if f.endswith(".json")]
+        for old in sorted(paths, key=os.path.getmtime)[:-keep_last]:
+            try:
+                os.remove(old)
+            except OSError:
+                pass  # Ya borrado por otro proceso
+
+    def load_checkpoint(self, run_id=None):
+        """Restaura el checkpoint válido más reciente (o el del run_id indicado)"""
+        if not os.path.isdir(CHECKPOINT_DIR):
+            return False
+        
+        candidates = [f for f in os.listdir(CHECKPOINT_DIR) if f.endswith(".json")]
+        if run_id:
+            candidates = [f for f in candidates if f == f"{run_id}.json"]
+        
+        # El más reciente según saved_at (no por nombre de archivo)
+        restored = []
+        for filename in candidates:
+            try:
+                restored.append(self._read_state(os.path.join(CHECKPOINT_DIR, filename)))
+            except Exception as e:
+                logging.warning(f"  ⚠️ Checkpoint {filename} inválido: {e}")
+        
+        if restored:
+            state, pools, regional_data, thematic_groups = max(restored, key=lambda r: r[0]["saved_at"])
+            self.run_id = state["run_id"]
+            self.phase_completed = state["phase_completed"]
+            self.stats = state["stats"]
+            self.regional_pools = pools
+            self.regional_data = regional_data
+            self.thematic_groups = thematic_groups
+            self.alignment = state["alignment"]
+            self.trends = state.get("trends", {})
+            self._synthesis_cache = {
+                category: (frozenset(data["ids"]), data["text"])
+                for category, data in state.get("category_syntheses", {}).items()
+            }
+            logging.info(f"♻️ Checkpoint restaurado: run {self.run_id} (fase completada: {self.phase_completed}, "
+                         f"{len(regional_data)} regiones)")
+            return True
+        
+        return False
+
+    def run_shard(self, shard_dir, batch_id, embed=False):
+        """Modo shard: Fase 1 (y opcionalmente embeddings) solo para self.regions; escribe un artefacto parcial"""
+        logging.info(f"🧩 SHARD: {', '.join(self.regions)} (lote {batch_id})")
+        try:
+            if PIPELINE["streaming"]["enabled"]:
+                self.stream_regions(embed=embed)
+            else:
+                self.fetch_and_synthesize_by_region()
+            
+            if embed:
+                selected = [item for data in self.regional_data.values() for item in data["items"]]
+                self._embed_items([item for item in selected if not item.embedding])
+            
+            os.makedirs(shard_dir, exist_ok=True)
+            path = os.path.join(shard_dir, f"shard_{self.run_id}.json")
+            state = self._state_dict(phase=1)
+            state["shard_batch"] = batch_id
+            self._write_state(path, state)
+            logging.info(f"✅ Shard guardado: {path} ({len(self.regional_data)} regiones, {self.stats['total_selected']} noticias)")
+            return True
+        except Exception as e:
+            logging.error(f"FATAL: {e}", exc_info=True)
+            return False
+
+    def merge_shards(self, shard_dir, batch_id=None):
+        """Une los artefactos de shard de un lote (pools, selecciones, embeddings) en el estado de este run.
+        Sin batch_id se une el lote del artefacto más reciente"""
+        logging.info(f"🧩 MERGE: Combinando shards de {shard_dir}...")
+        
+        shards = []
+        for filename in sorted(f for f in os.listdir(shard_dir) if f.startswith("shard_") and f.endswith(".json")):
+            try:
+                state, pools, regional_data, _ = self._read_state(os.path.join(shard_dir, filename))
+            except Exception as e:
+                logging.warning(f"  ⚠️ Shard {filename} inválido: {e}")
+                continue
+            shards.append((filename, state, pools, regional_data))
+        if not shards:
+            raise RuntimeError(f"Ningún shard válido en {shard_dir}")
+        
+        # Orden por saved_at: si una región se repite dentro del lote, gana el artefacto más reciente
+        shards.sort(key=lambda s: s[1]["saved_at"])
+        if batch_id is None:
+            batch_id = shards[-1][1].get("shard_batch")
+        ignored = [s[0] for s in shards if s[1].get("shard_batch") != batch_id]
+        if ignored:
+            logging.warning(f"  ⚠️ {len(ignored)} shards de otros lotes ignorados: {', '.join(ignored)}")
+        shards = [s for s in shards if s[1].get("shard_batch") == batch_id]
+        
+        for filename, state, pools, regional_data in shards:
+            for region in pools:
+                if region in self.regional_pools:
+                    logging.warning(f"  ⚠️ {region} presente en varios shards. Se usa {filename}")
+                    self.stats["total_fetched"] -= len(self.regional_pools[region])
+                    if region in self.regional_data:
+                        self.stats["total_selected"] -= len(self.regional_data.pop(region)["items"])
+                        self.stats["regions_processed"] -= 1
+            self.regional_pools.update(pools)
+            self.regional_data.update(regional_data)
+            
+            for key in ("total_fetched", "total_selected", "regions_processed", "embedding_requests"):
+                self.stats[key] = self.stats.get(key, 0) + state["stats"].get(key, 0)
+            logging.info(f"  ✓ {filename}: {', '.join(sorted(regional_data)) or 'sin regiones'}")
+            self.merged_shards.append(os.path.join(shard_dir, filename))
+        
+        if not self.regional_data:
+            raise RuntimeError(f"Ningún shard válido del lote {batch_id} en {shard_dir}")
+        self.stats["shards_merged"] = len(shards)
+        self.stats["shard_batch"] = batch_id
+
+    def run(self, resume=None, from_phase=None, merge_dir=None, batch_id=None):
         try:
-            self.fetch_and_synthesize_by_region()  # FASE 1
-            self.classify_by_theme()                # FASE 2
-            self.calculate_proximity()              # FASE 3
-            self.save_audit_csv()                   # FASE 4 (Audit)
-            self.export()                           # FASE 5 (Export)
+            start_phase = 1
+            if merge_dir:
+                # Fase 1 ya ejecutada por los shards: continuar con la unión
+                self.merge_shards(merge_dir, batch_id)
+                self._save_checkpoint(1)
+                start_phase = 2
+            elif resume or from_phase:
+                if self.load_checkpoint(None if resume in (None, "latest") else resume):
+                    start_phase = self.phase_completed + 1
+                else:
+                    logging.warning("⚠️ Sin checkpoint válido. Iniciando run desde cero")
+            
+            if from_phase:
+                if from_phase > self.phase_completed + 1:
+                    logging.error(f"FATAL: --from-phase {from_phase} requiere un checkpoint con la fase {from_phase - 1} completada")
+                    return False
+                start_phase = from_phase
+                if from_phase == 1:
+                    # Re-sintetizar todas las regiones sobre los pools ya descargados
+                    # (para reintentar solo las que fallaron basta con --resume)
+                    self.regional_data = {}
+                    self.stats["total_selected"] = 0
+                    self.stats["regions_processed"] = 0
             
+            if start_phase > 5:
+                logging.info(f"✅ Run {self.run_id} ya completado. Nada que reanudar")
+                return True
+            
+            phases = [
+                (1, self.fetch_and_synthesize_by_region),  # FASE 1
+                (2, self.classify_by_theme),                # FASE 2
+                (3, self.calculate_proximity),              # FASE 3
+                (3, self.align_cross_region),               # FASE 3b (Alineación)
+                (4, self.save_audit_csv),                   # FASE 4 (Audit)
+                (4, self.update_trends),                    # FASE 4b (Tendencias)
+                (5, self.export)                            # FASE 5 (Export)
+            ]
+            if start_phase == 1 and not from_phase and PIPELINE["streaming"]["enabled"]:
+                # Fases 1-2 y los embeddings de la 3 solapados en un solo pipeline
+                # (--from-phase 1 re-sintetiza de forma secuencial sobre los pools del checkpoint)
+                phases = [(2, self.stream_regions)] + phases[2:]
+            
+            for i, (phase, step) in enumerate(phases):
+                if phase < start_phase:
+                    continue
+                step()
+                # Checkpoint al cerrar cada fase (la 3 incluye la alineación 3b). Regiones sin
+                # síntesis, items sin embedding o síntesis de respaldo dejan abierta su fase:
+                # --resume reintenta solo ese trabajo
+                if i + 1 == len(phases) or phases[i + 1][0] != phase:
+                    self._save_checkpoint(self._completed_phase(phase))
+            
+            incomplete = self.incomplete_work()
+            for _, description in incomplete:
+                logging.warning(f"⚠️ Run {self.run_id} incompleto: {description}")
+            if incomplete:
+                logging.warning(f"   Reintentar solo lo pendiente con --resume {self.run_id}")
+            
+            # Lote unido y exportado: sus artefactos no deben entrar en un --merge posterior
+            for path in self.merged_shards:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
             logging.info(f"🎯 Pipeline V5 Completado: {self.stats}")
             return True
         except Exception as e:
             logging.error(f"FATAL: {e}", exc_info=True)
             return False
 
+    # --- MODO RESIDENTE (DAEMON) ---
+    def run_daemon(self):
+        """Modo residente: sondeo adaptativo por feed y republicación incremental del carrusel"""
+        cfg = PIPELINE["daemon"]
+        logging.info("🛰️ DAEMON: Modo residente con sondeo adaptativo por feed...")
+        
+        self._stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *_: self._stop.set())
+        self.checkpointing = False  # Estado residente en memoria: no contamina los checkpoints de --resume
+        
+        self.feed_state = {
+            url: {"region": region, "etag": None, "modified": None, "seen": {},
+                  "interval": cfg["initial_interval_seconds"], "next_poll": 0.0}
+            for region, feeds in self._active_feeds().items() for url in feeds
+        }
+        self.stats["daemon"] = {"polls": 0, "not_modified": 0, "new_items": 0, "publishes": 0}
+        new_counts = defaultdict(int)
+        last_publish = 0.0
+        last_trends = 0.0
+        
+        try:
+            while not self._stop.is_set():
+                now = time.time()
+                try:
+                    due = [url for url, st in self.feed_state.items() if st["next_poll"] <= now]
+                    if due:
+                        for region, items in self._poll_feeds(due):
+                            new_counts[region] += self._add_to_pool(region, items)
+                    
+                    total_new = sum(new_counts.values())
+                    stale = total_new and now - last_publish >= cfg["republish_max_staleness_minutes"] * 60
+                    if total_new >= cfg["republish_min_new_items"] or stale:
+                        update_trends = now - last_trends >= cfg["trend_update_minutes"] * 60
+                        # Se consumen antes de publicar: un ciclo fallido no se reintenta en bucle
+                        regions = [r for r, n in new_counts.items() if n]
+                        new_counts.clear()
+                        last_publish = now
+                        if update_trends:
+                            last_trends = now
+                        self._republish(regions, update_trends)
+                except Exception as e:
+                    # Un ciclo fallido (síntesis, alineación, exportación, disco...) no detiene el daemon
+                    logging.error(f"Error en ciclo del daemon: {e}", exc_info=True)
+                
+                next_poll = min(st["next_poll"] for st in self.feed_state.values())
+                self._stop.wait(max(1.0, min(next_poll - time.time(), cfg["tick_seconds"])))
+        except KeyboardInterrupt:
+            pass
+        
+        logging.info(f"🛑 DAEMON detenido: {self.stats['daemon']}")
+        return True
+
+    def _poll_feeds(self, urls):
+        """Sondea los feeds vencidos en paralelo; devuelve [(región, items nuevos)]"""
+        with ThreadPoolExecutor(max_workers=PIPELINE["streaming"]["fetch_workers"]) as executor:
+            return list(executor.map(self._poll_feed, urls))
+
+    def _poll_feed(self, url):
+        """GET condicional de un feed; aprende su intervalo de publicación y agenda el próximo sondeo"""
+        cfg = PIPELINE["daemon"]
+        pool_size = PIPELINE["collection_params"]["pool_size_per_region"]
+        st = self.feed_state[url]
+        region = st["region"]
+        new_items = []
+        
+        try:
+            d = feedparser.parse(url, etag=st["etag"], modified=st["modified"])
+            with self._lock:
+                self.stats["daemon"]["polls"] += 1
+            st["etag"] = d.get("etag", st["etag"])
+            st["modified"] = d.get("modified", st["modified"])
+            
+            if d.get("status") == 304:
+                with self._lock:
+                    self.stats["daemon"]["not_modified"] += 1
+                st["interval"] *= cfg["backoff"]
+            else:
+                timestamps = []
+                for entry in d.entries[:pool_size]:
+                    title = entry.get('title', '')
+                    if not title: continue
+                    link = entry.get('link', '')
+                    published = entry.get('published_parsed') or entry.get('updated_parsed')
+                    if published:
+                        timestamps.append(calendar.timegm(published))
+                    
+                    item_id = hashlib.md5(f"{title}|{link}".encode()).hexdigest()
+                    if item_id in st["seen"]:
+                        continue
+                    st["seen"][item_id] = True
+                    desc = entry.get('summary', '') or entry.get('description', '')
+                    new_items.append(NewsItem(item_id, title, link, region, url, desc))
+                
+                # Memoria acotada de ids vistos (dict conserva el orden de inserción)
+                for old_id in list(st["seen"])[:max(0, len(st["seen"]) - 2 * pool_size)]:
+                    del st["seen"][old_id]
+                
+                timestamps.sort(reverse=True)
+                gaps = [a - b for a, b in zip(timestamps, timestamps[1:]) if a > b]
+                if gaps:
+                    # Intervalo típico de publicación: mediana de los huecos, suavizada entre sondeos
+                    alpha = cfg["interval_smoothing"]
+                    st["interval"] = (1 - alpha) * st["interval"] + alpha * statistics.median(gaps)
+                elif not new_items:
+                    st["interval"] *= cfg["backoff"]
+        except Exception as e:
+            logging.warning(f"Feed error {url}: {e}")
+            st["interval"] *= cfg["backoff"]
+        
+        # El intervalo aprendido es el de publicación; se sondea a una fracción de él
+        st["interval"] = min(st["interval"], cfg["max_poll_seconds"] / cfg["poll_factor"])
+        delay = min(max(st["interval"] * cfg["poll_factor"], cfg["min_poll_seconds"]), cfg["max_poll_seconds"])
+        st["next_poll"] = time.time() + delay
+        return region, new_items
+
+    def _add_to_pool(self, region, items):
+        """Añade items nuevos al pool caliente de la región (más recientes primero, tamaño acotado)"""
+        if not items:
+            return 0
+        pool_size = PIPELINE["collection_params"]["pool_size_per_region"]
+        pool = self.regional_pools.get(region, [])
+        known = {x.title.lower() for x in pool}
+        fresh = self._merge_pool([[item for item in items if item.title.lower() not in known]])
+        
+        # Se descartan primero los items más antiguos; los de la selección vigente se conservan
+        # (siguen exportándose y referenciados hasta que la región se re-sintetice con éxito)
+        merged = fresh + pool
+        selected = {id(x) for x in self.regional_data.get(region, {}).get("items", [])}
+        evicted = set()
+        for item in reversed(merged):
+            if len(merged) - len(evicted) <= pool_size:
+                break
+            if id(item) not in selected:
+                evicted.add(id(item))
+        self.regional_pools[region] = [x for x in merged if id(x) not in evicted]
+        self.stats["daemon"]["new_items"] += len(fresh)
+        return len(fresh)
+
+    def _republish(self, regions, update_trends):
+        """Re-sintetiza solo las regiones con novedades y regenera el carrusel con el estado caliente"""
+        logging.info(f"🔄 DAEMON: Republicando ({', '.join(regions)})...")
+        min_items = PIPELINE["collection_params"]["min_items_for_synthesis"]
+        self.run_id = datetime.datetime.now().strftime("%Y-%m-%d_%H%M")
+        self.start_time = time.time()
+        # Cada ciclo vuelve a intentar los embeddings que fallaron (p.ej. cuota ya recuperada)
+        self._embedding_failed.clear()
+        self._embedding_aborted.clear()
+        
+        for region in regions:
+            pool = self.regional_pools[region]
+            if len(pool) < min_items:
+                logging.info(f"  ⏳ {region}: {len(pool)} items en pool (mínimo {min_items})")
+                continue
+            selected_items = self._synthesize_region(region, pool)
+            if selected_items and region in self.regional_data:
+                # Sustituye la selección anterior de la región
+                self.stats["total_selected"] -= len(self.regional_data.pop(region)["items"])
+                self.stats["regions_processed"] -= 1
+            self._apply_regional_selection(region, pool, selected_items)
+        
+        if not self.regional_data:
+            return
+        self.stats["total_fetched"] = sum(len(pool) for pool in self.regional_pools.values())
+        
+        # Los items que siguen seleccionados conservan su embedding: solo se embeben los nuevos
+        self.classify_by_theme()
+        self.calculate_proximity()
+        self.align_cross_region()
+        if PIPELINE["daemon"]["write_audit_csv"]:
+            self.save_audit_csv()
+        if update_trends:
+            self.update_trends()
+        self.export()
+        self.stats["daemon"]["publishes"] += 1
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--mode", default="tactical")
+    parser.add_argument("--resume", nargs="?", const="latest", default=None,
+                        help="Reanudar desde el último checkpoint válido (o el RUN_ID indicado)")
+    parser.add_argument("--embedding-backend", choices=sorted(EMBEDDING_BACKENDS), default=None,
+                        help="Backend de embeddings de la Fase 3 (por defecto: phase3_proximity.json)")
+    parser.add_argument("--from-phase", type=int, choices=range(1, 6), default=None,
+                        help="Reanudar desde esta fase reutilizando el checkpoint de las anteriores")
+    parser.add_argument("--regions", default=None,
+                        help="Modo shard: regiones separadas por coma; ejecuta solo la Fase 1 y escribe un artefacto parcial")
+    parser.add_argument("--shard-embed", action="store_true",
+                        help="En modo shard, calcular también los embeddings de las noticias seleccionadas")
+    parser.add_argument("--batch-id", default=os.environ.get("GITHUB_RUN_ID"),
+                        help="Lote de shards: se registra con --regions y filtra con --merge "
+                             "(por defecto GITHUB_RUN_ID; sin él, la fecha al escribir y el lote más reciente al unir)")
+    parser.add_argument("--shard-dir", default=SHARD_DIR,
+                        help="Directorio de artefactos de shard (escritura con --regions, lectura con --merge)")
+    parser.add_argument("--daemon", action="store_true",
+                        help="Modo residente: sondeo adaptativo por feed y republicación incremental")
+    parser.add_argument("--merge", action="store_true",
+                        help="Unir los shards de --shard-dir y ejecutar las Fases 2-5 sobre la unión")
     args = parser.parse_args()
     
     key = os.environ.get("GEMINI_API_KEY")
@@ -488,5 +1520,20 @@ if __name__ == "__main__":
     logging.info(f"⚙️  Modo: {args.mode}")
     logging.info(f"📋 Pipeline: {PIPELINE['version']}")
     
-    collector = GeoCoreCollector(key)
-    sys.exit(0 if collector.run() else 1)
+    if args.regions:
+        regions = [r.strip() for r in args.regions.split(",") if r.strip()]
+        unknown = [r for r in regions if r not in RSS_FEEDS]
+        if unknown:
+            print(f"❌ Regiones desconocidas: {', '.join(unknown)} (disponibles: {', '.join(RSS_FEEDS)})"); sys.exit(1)
+        collector = GeoCoreCollector(key, embedding_backend=args.embedding_backend, regions=regions)
+        batch_id = args.batch_id or datetime.datetime.now().strftime("%Y-%m-%d")
+        sys.exit(0 if collector.run_shard(args.shard_dir, batch_id, embed=args.shard_embed) else 1)
+    
+    if args.daemon:
+        collector = GeoCoreCollector(key, embedding_backend=args.embedding_backend)
+        sys.exit(0 if collector.run_daemon() else 1)
+    
+    collector = GeoCoreCollector(key, embedding_backend=args.embedding_backend)
+    merge_dir = args.shard_dir if args.merge else None
+    ok = collector.run(resume=args.resume, from_phase=args.from_phase, merge_dir=merge_dir, batch_id=args.batch_id)
+    sys.exit(1 if not ok else EXIT_INCOMPLETE if collector.incomplete_work() else 0)
@@ -0,0 +1,185 @@
+# PROXIMITY ENGINE - Streaming Trend & Burst Detection (per run, O(1) per term)
+import os
+import copy
+import json
+import re
+import datetime
+import logging
+from collections import defaultdict, Counter
+
+TOKEN_RE = re.compile(r"[^\W\d_]+", re.UNICODE)
+
+def extract_terms(text, stopwords, min_length=4, max_terms=6):
+    """Extrae los términos más frecuentes de un texto (minúsculas, sin stopwords)"""
+    counts = Counter(
+        token for token in TOKEN_RE.findall(text.lower())
+        if len(token) >= min_length and token not in stopwords
+    )
+    return [term for term, _ in counts.most_common(max_terms)]
+
+def ew_update(stat, x, alpha):
+    """Actualiza media/varianza exponencialmente ponderadas con una observación"""
+    diff = x - stat["mean"]
+    incr = alpha * diff
+    stat["mean"] += incr
+    stat["var"] = (1 - alpha) * (stat["var"] + diff * incr)
+
+def ew_decay(stat, k, alpha):
+    """Aplica k observaciones nulas (runs sin apariciones) en forma cerrada"""
+    if k <= 0:
+        return
+    f = (1 - alpha) ** k
+    stat["var"] = f * (stat["var"] + stat["mean"] ** 2 * (1 - f))
+    stat["mean"] *= f
+
+class TrendEngine:
+    """Estadísticas EWMA por término y por área que se actualizan al cerrar cada run.
+
+    Los términos ausentes en un run no se tocan: su decaimiento se aplica en forma
+    cerrada la próxima vez que aparecen, así que cada run cuesta O(1) por término observado.
+    El último run guarda los valores previos de lo que tocó ("undo"): si se vuelve a cerrar
+    (reanudación con más regiones o embeddings), su contribución anterior se reemplaza.
+    """
+
+    def __init__(self, config, state_path):
+        ewm = config["ewm"]
+        self.alpha = ewm["alpha"]
+        self.z_threshold = ewm["burst_z_threshold"]
+        self.min_count = ewm["min_term_count"]
+        self.warmup_runs = ewm["warmup_runs"]
+        self.max_bursts = ewm["max_bursts"]
+        self.delta_threshold = ewm["trend_delta_threshold"]
+        self.prune_below = ewm["prune_below"]
+        self.state_path = state_path
+        self.state = {"run_index": 0, "last_run_id": None, "terms": {}, "areas": {}, "snapshot": {}}
+        self._reset_run()
+
+    def _reset_run(self):
+        self._run_terms = Counter()
+        self._run_term_areas = defaultdict(Counter)
+        self._run_areas = defaultdict(lambda: {"count": 0, "proximity_sum": 0.0})
+
+    def load(self):
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r', encoding='utf-8') as f:
+                    self.state = json.load(f)
+            except Exception as e:
+                logging.warning(f"Estado de tendencias inválido ({e}). Reiniciando")
+        return self
+
+    def observe(self, area, terms, proximity):
+        """Registra un item del run en curso"""
+        self._run_areas[area]["count"] += 1
+        self._run_areas[area]["proximity_sum"] += proximity
+        for term in terms:
+            self._run_terms[term] += 1
+            self._run_term_areas[term][area] += 1
+
+    def close_run(self, run_id):
+        """Cierra el run: calcula z-scores contra la historia y actualiza las estadísticas"""
+        if run_id == self.state["last_run_id"]:
+            if not self.state.get("undo"):
+                # Estado sin undo: no contar dos veces
+                self._reset_run()
+                return self.state["snapshot"]
+            # Reanudación del mismo run: deshacer su contribución anterior y recalcular
+            self._rollback()
+
+        index = self.state["run_index"] + 1
+        warm = self.state["run_index"] >= self.warmup_runs
+        undo = {
+            "run_index": self.state["run_index"],
+            "last_run_id": self.state["last_run_id"],
+            "snapshot": self.state["snapshot"],
+            "terms": {term: copy.deepcopy(self.state["terms"].get(term)) for term in self._run_terms},
+            "areas": {area: copy.deepcopy(self.state["areas"].get(area)) for area in self._run_areas}
+        }
+
+        bursts = []
+        for term, count in self._run_terms.items():
+            stat = self.state["terms"].setdefault(term, {"mean": 0.0, "var": 0.0, "last": index - 1})
+            ew_decay(stat, index - stat["last"] - 1, self.alpha)
+            z = (count - stat["mean"]) / max(stat["var"] ** 0.5, 1.0)
+            if warm and z >= self.z_threshold and count >= self.min_count:
+                bursts.append({
+                    "term": term,
+                    "count": count,
+                    "z": round(z, 2),
+                    "area": self._run_term_areas[term].most_common(1)[0][0]
+                })
+            ew_update(stat, count, self.alpha)
+            stat["last"] = index
+
+        areas = {}
+        for area, run in self._run_areas.items():
+            stat = self.state["areas"].setdefault(area, {
+                "volume": {"mean": 0.0, "var": 0.0}, "proximity": {"mean": 0.0, "var": 0.0}, "last": index - 1, "runs": 0
+            })
+            missed = index - stat["last"] - 1
+            ew_decay(stat["volume"], missed, self.alpha)
+
+            avg_proximity = run["proximity_sum"] / run["count"]
+            volume_z = (run["count"] - stat["volume"]["mean"]) / max(stat["volume"]["var"] ** 0.5, 1.0)
+            delta = avg_proximity - stat["proximity"]["mean"] if stat["runs"] else 0.0
+            areas[area] = {
+                "count": run["count"],
+                "volume_z": round(volume_z, 2) if stat["runs"] else 0.0,
+                "avg_proximity": round(avg_proximity, 2),
+                "proximity_delta": round(delta, 2),
+                "trend": "↑" if delta > self.delta_threshold else "↓" if delta < -self.delta_threshold else "→",
+                "emerging_terms": []
+            }
+
+            # Ambas medias se siembran con la primera observación (no parten de cero)
+            if stat["runs"]:
+                ew_update(stat["volume"], run["count"], self.alpha)
+                ew_update(stat["proximity"], avg_proximity, self.alpha)
+            else:
+                stat["volume"]["mean"] = run["count"]
+                stat["proximity"]["mean"] = avg_proximity
+            stat["last"] = index
+            stat["runs"] += 1
+
+        bursts.sort(key=lambda b: b["z"], reverse=True)
+        bursts = bursts[:self.max_bursts]
+        for burst in bursts:
+            areas[burst["area"]]["emerging_terms"].append(burst["term"])
+
+        self.state["run_index"] = index
+        self.state["last_run_id"] = run_id
+        self.state["undo"] = undo
+        self.state["snapshot"] = {
+            "run_id": run_id,
+            "generated": datetime.datetime.now().isoformat(),
+            "warm": warm,
+            "bursts": bursts,
+            "areas": areas
+        }
+        self._reset_run()
+        return self.state["snapshot"]
+
+    def _rollback(self):
+        """Restaura el estado previo al último run cerrado"""
+        undo = self.state.pop("undo")
+        for key in ("terms", "areas"):
+            for name, previous in undo[key].items():
+                if previous is None:
+                    self.state[key].pop(name, None)
+                else:
+                    self.state[key][name] = previous
+        self.state["run_index"] = undo["run_index"]
+        self.state["last_run_id"] = undo["last_run_id"]
+        self.state["snapshot"] = undo["snapshot"]
+
+    def save(self):
+        """Persiste el estado, descartando términos cuya media decaída ya es despreciable"""
+        index = self.state["run_index"]
+        self.state["terms"] = {
+            term: stat for term, stat in self.state["terms"].items()
+            if stat["mean"] * (1 - self.alpha) ** (index - stat["last"]) >= self.prune_below
+        }
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        with open(self.state_path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False)
+        os.replace(self.state_path + ".tmp", self.state_path)